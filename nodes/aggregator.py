@@ -0,0 +1,333 @@
+# nodes/aggregator.py
+import argparse
+import queue
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from flask import Flask, request, jsonify
+import os
+
+from rollup import RollupStore, parse_timestamp
+from segments import SegmentedLog
+
+# Biến toàn cục
+raw_log = None              # Bản đọc thô: các file JSON Lines chỉ ghi nối, mỗi giờ một file
+seen_ids = set()            # Chỉ mục chống trùng: 'id' của bản đọc ĐÃ ghi xuống đĩa
+pending_ids = {}            # 'id' đang chờ ghi -> IngestTicket của lô chứa nó
+seen_lock = threading.Lock()
+ingest_queue = None         # Hàng đợi có giới hạn giữa API và luồng ghi
+rollups = None              # Rollup tăng dần theo bucket 1m/1h/1d
+stats = {"accepted": 0, "duplicates": 0, "expired": 0, "rejected": 0, "written": 0, "write_batches": 0}
+
+# Số bản đọc tối đa gộp vào một lần ghi
+WRITE_BATCH_SIZE = 5000
+# Số giây client nên đợi trước khi gửi lại khi hàng đợi đầy
+RETRY_AFTER_SECONDS = 2
+# Số giây /ingest chờ luồng ghi xác nhận đã lưu (phải nhỏ hơn timeout của thùng rác)
+ACK_TIMEOUT_SECONDS = 2
+# Chu kỳ (giây) áp dụng chính sách lưu giữ dữ liệu
+EXPIRE_INTERVAL_SECONDS = 300
+
+# ===============================
+# HÀM PHỤ TRỢ
+# ===============================
+def load_seen_ids(log):
+    """
+    Xây dựng chỉ mục 'id' từ dữ liệu đã lưu (chỉ quét 1 lần khi khởi động),
+    thay cho việc tìm 'id' trong kho với từng bản đọc.
+    """
+    return {doc['id'] for doc in log.all() if 'id' in doc}
+
+
+class IngestTicket:
+    """Một lô chờ ghi; request /ingest đợi ticket này trước khi trả acked_ids."""
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.done = threading.Event()
+        self.ok = False
+
+
+def clean_reading(doc):
+    """Bỏ cờ 'synced' (chỉ có ý nghĩa ở phía thùng rác) trước khi lưu."""
+    return {k: v for k, v in doc.items() if k != 'synced'}
+
+
+def has_valid_timestamp(doc):
+    """Bản đọc có 'timestamp' ISO 8601 đọc được (cần để xếp vào đoạn thô và bucket rollup)."""
+    try:
+        parse_timestamp(doc['timestamp'])
+        return True
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+
+
+def is_expired(doc, rollup_store, now):
+    """
+    Bản đọc cũ hơn hạn lưu giữ bản đọc thô. Những bản đọc này bị /ingest bỏ qua,
+    nên có thể gỡ 'id' của chúng khỏi chỉ mục mà không sợ bị cộng trùng vào rollup.
+    """
+    raw_retention = rollup_store.retention.get('raw')
+    if raw_retention is None:
+        return False
+    try:
+        return parse_timestamp(doc['timestamp']) < now - raw_retention
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+
+
+def expire_old_data(log, rollup_store, now=None):
+    """
+    Xóa các đoạn bản đọc thô / bucket quá hạn và gỡ 'id' tương ứng khỏi chỉ mục chống trùng
+    (an toàn vì /ingest từ chối lưu bản đọc quá hạn, xem is_expired).
+    """
+    now = now or datetime.now(timezone.utc)
+    removed_ids = []
+    if 'raw' in rollup_store.retention:
+        removed_ids = log.expire(now - rollup_store.retention['raw'])
+    removed_buckets = rollup_store.expire(now)
+    if removed_ids:
+        with seen_lock:
+            seen_ids.difference_update(removed_ids)
+    if removed_ids or removed_buckets:
+        print(f"[Aggregator] Lưu giữ: đã xóa {len(removed_ids)} bản đọc thô, {removed_buckets} bucket.")
+
+
+def writer_loop(log, rollup_store, q, stop_event):
+    """
+    Luồng ghi duy nhất: gom nhiều lô trong hàng đợi thành một lần nối vào
+    đoạn hiện tại của kho bản đọc thô (một lần fsync cho hàng nghìn bản đọc).
+    Rollup được cộng dồn ngay sau khi lô được ghi.
+    """
+    next_expire = time.monotonic() + EXPIRE_INTERVAL_SECONDS
+    while not stop_event.is_set() or not q.empty():
+        if time.monotonic() >= next_expire:
+            next_expire = time.monotonic() + EXPIRE_INTERVAL_SECONDS
+            try:
+                expire_old_data(log, rollup_store)
+            except Exception as e:
+                print(f"[Aggregator] Lỗi áp dụng chính sách lưu giữ: {e}")
+
+        try:
+            tickets = [q.get(timeout=0.5)]
+        except queue.Empty:
+            continue
+
+        pending = list(tickets[0].readings)
+        while len(pending) < WRITE_BATCH_SIZE:
+            try:
+                tickets.append(q.get_nowait())
+                pending.extend(tickets[-1].readings)
+            except queue.Empty:
+                break
+
+        try:
+            log.append(pending)
+            written = True
+        except Exception as e:
+            written = False
+            print(f"[Aggregator] Lỗi ghi {len(pending)} bản đọc: {e}")
+
+        # Chỉ sau khi đã ghi mới đưa id vào chỉ mục; lỗi ghi thì gỡ id để thùng rác gửi lại
+        with seen_lock:
+            for doc in pending:
+                pending_ids.pop(doc['id'], None)
+                if written:
+                    seen_ids.add(doc['id'])
+            if written:
+                stats["written"] += len(pending)
+                stats["write_batches"] += 1
+        for ticket in tickets:
+            ticket.ok = written
+            ticket.done.set()
+            q.task_done()
+
+        if written:
+            try:
+                rollup_store.add_readings(pending)
+            except Exception as e:
+                print(f"[Aggregator] Lỗi cập nhật rollup: {e}")
+
+# ===============================
+# KHỞI TẠO ỨNG DỤNG AGGREGATOR
+# ===============================
+def create_app(data_dir, queue_size=200, retention=None, tz_offset_hours=7):
+    """
+    data_dir: thư mục dữ liệu; bản đọc thô nằm ở data_dir/raw (mỗi giờ một file),
+    rollup ở data_dir/rollups (mỗi cửa sổ thời gian một file).
+    retention: {'raw': timedelta, '1m': timedelta, '1h': ..., '1d': ...};
+    khóa nào không có thì dữ liệu tương ứng được giữ mãi.
+    tz_offset_hours: múi giờ căn bucket 1 ngày (mặc định +7, trùng với timestamp của SmartBin).
+    """
+    app = Flask(__name__)
+    global raw_log, ingest_queue, seen_ids, rollups
+
+    raw_log = SegmentedLog(os.path.join(data_dir, 'raw'))
+    seen_ids = load_seen_ids(raw_log)
+    pending_ids.clear()
+    rollups = RollupStore(os.path.join(data_dir, 'rollups'), retention=retention, tz_offset_hours=tz_offset_hours)
+    if rollups.is_empty() and not raw_log.is_empty():
+        # Rollup bị mất/xóa: tính lại một lần từ dữ liệu thô
+        rollups.add_readings(raw_log.all())
+    ingest_queue = queue.Queue(maxsize=queue_size)
+    app.config['DATA_DIR'] = data_dir
+
+    stop_event = threading.Event()
+    writer = threading.Thread(target=writer_loop, args=(raw_log, rollups, ingest_queue, stop_event), daemon=True)
+    writer.start()
+    app.config['WRITER_STOP'] = stop_event
+    app.config['WRITER_THREAD'] = writer
+
+    # ------------------------------------
+    # 1️⃣ API: INGEST (theo lô, idempotent)
+    # ------------------------------------
+    @app.route('/ingest', methods=['POST'])
+    def ingest():
+        """
+        Nhận một lô bản đọc từ thùng rác: {"readings": [...]}.
+        - acked_ids chỉ được trả về sau khi luồng ghi đã lưu lô xuống đĩa
+          (giao ít nhất một lần + chống trùng theo 'id').
+        - Bản đọc có 'id' đã lưu được bỏ qua nhưng vẫn được xác nhận, nên thùng rác
+          gửi lại sau khi mất kết nối không tạo bản ghi trùng.
+        - Bản đọc cũ hơn hạn lưu giữ bản đọc thô được xác nhận nhưng không lưu,
+          để bản gửi lại muộn không bị cộng lần nữa vào bucket 1h/1d.
+        - Khi hàng đợi ghi đầy, lỗi ghi hoặc quá ACK_TIMEOUT_SECONDS, trả về
+          503 + Retry-After (backpressure); thùng rác giữ bản đọc và gửi lại sau.
+        """
+        data = request.get_json(silent=True) or {}
+        readings = data.get('readings')
+        if not isinstance(readings, list):
+            return jsonify({"ok": False, "error": "Thiếu danh sách readings"}), 400
+        if any(not isinstance(d, dict) or not isinstance(d.get('id'), str) or not d['id'] for d in readings):
+            return jsonify({"ok": False, "error": "Mỗi bản đọc phải có 'id' dạng chuỗi"}), 400
+        if not all(has_valid_timestamp(d) for d in readings):
+            return jsonify({"ok": False, "error": "Mỗi bản đọc phải có 'timestamp' ISO 8601"}), 400
+
+        def overloaded(error):
+            with seen_lock:
+                stats["rejected"] += len(readings)
+            response = jsonify({"ok": False, "error": error})
+            response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return response, 503
+
+        fresh = []
+        fresh_ids = set()   # 'id' đã nhận trong chính request này (lô có thể chứa id lặp lại)
+        expired = 0
+        waiting = set()     # Các lô (của request này hoặc request trước) cần được ghi xong
+        now = datetime.now(timezone.utc)
+        with seen_lock:
+            for d in readings:
+                if d['id'] in seen_ids or d['id'] in fresh_ids:
+                    continue
+                if is_expired(d, rollups, now):
+                    expired += 1
+                    continue
+                if d['id'] in pending_ids:
+                    waiting.add(pending_ids[d['id']])
+                    continue
+                fresh.append(clean_reading(d))
+                fresh_ids.add(d['id'])
+            if fresh:
+                ticket = IngestTicket(fresh)
+                try:
+                    ingest_queue.put_nowait(ticket)
+                except queue.Full:
+                    ticket = None
+                else:
+                    for doc in fresh:
+                        pending_ids[doc['id']] = ticket
+                    waiting.add(ticket)
+        if fresh and ticket is None:
+            return overloaded("Aggregator đang quá tải, thử lại sau")
+
+        deadline = time.monotonic() + ACK_TIMEOUT_SECONDS
+        for t in waiting:
+            if not t.done.wait(max(0.0, deadline - time.monotonic())) or not t.ok:
+                return overloaded("Chưa ghi được lô xuống đĩa, thử lại sau")
+
+        duplicates = len(readings) - len(fresh) - expired
+        with seen_lock:
+            stats["accepted"] += len(fresh)
+            stats["duplicates"] += duplicates
+            stats["expired"] += expired
+        return jsonify({
+            "ok": True,
+            "received": len(fresh),
+            "duplicates": duplicates,
+            "expired": expired,
+            "acked_ids": [d['id'] for d in readings],
+        }), 200
+
+    # ------------------------------------
+    # 2️⃣ API: THỐNG KÊ
+    # ------------------------------------
+    @app.route('/stats', methods=['GET'])
+    def get_stats():
+        """Trạng thái hàng đợi và bộ đếm, phục vụ theo dõi backpressure."""
+        return jsonify(dict(stats, queue_depth=ingest_queue.qsize(),
+                            queue_capacity=ingest_queue.maxsize,
+                            known_ids=len(seen_ids))), 200
+
+    # ------------------------------------
+    # 3️⃣ API: ROLLUP THEO KHOẢNG THỜI GIAN
+    # ------------------------------------
+    @app.route('/rollups', methods=['GET'])
+    def get_rollups():
+        """
+        Đọc bucket đã tính sẵn: /rollups?resolution=1h&bin_id=bin-1&start=...&end=...
+        (start/end là ISO 8601, khoảng [start, end), start làm tròn xuống đầu bucket;
+        bin_id bỏ trống = mọi thùng).
+        """
+        try:
+            rows = rollups.query(request.args.get('resolution', '1h'),
+                                 bin_id=request.args.get('bin_id'),
+                                 start=request.args.get('start'),
+                                 end=request.args.get('end'))
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        return jsonify({"ok": True, "buckets": rows}), 200
+
+    # ------------------------------------
+    # 4️⃣ API: HEALTH CHECK
+    # ------------------------------------
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        return jsonify({"status": "ok"}), 200
+
+    return app
+
+
+def shutdown(app, timeout=10):
+    """
+    Dừng luồng ghi sau khi đã ghi hết các lô còn trong hàng đợi. Lô chưa kịp ghi
+    chưa được xác nhận, nên thùng rác vẫn giữ và sẽ gửi lại.
+    """
+    app.config['WRITER_STOP'].set()
+    app.config['WRITER_THREAD'].join(timeout=timeout)
+
+# ===============================
+# CHẠY ỨNG DỤNG AGGREGATOR
+# ===============================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the sensor ingestion Aggregator.')
+    parser.add_argument('--port', type=int, required=True, help='Cổng để chạy Aggregator.')
+    parser.add_argument('--data-dir', type=str, required=True, help='Thư mục dữ liệu (bản đọc thô + rollup).')
+    parser.add_argument('--queue-size', type=int, default=200, help='Số lô tối đa chờ ghi trước khi từ chối (503).')
+    parser.add_argument('--raw-retention-days', type=float, default=7, help='Số ngày giữ bản đọc thô.')
+    parser.add_argument('--minute-retention-days', type=float, default=2, help='Số ngày giữ bucket 1 phút.')
+    parser.add_argument('--hour-retention-days', type=float, default=90, help='Số ngày giữ bucket 1 giờ.')
+    parser.add_argument('--tz-offset-hours', type=float, default=7,
+                        help='Múi giờ căn bucket 1 ngày (không đổi sau khi đã có dữ liệu rollup).')
+    args = parser.parse_args()
+
+    retention = {
+        'raw': timedelta(days=args.raw_retention_days),
+        '1m': timedelta(days=args.minute_retention_days),
+        '1h': timedelta(days=args.hour_retention_days),
+    }
+    app = create_app(args.data_dir, queue_size=args.queue_size, retention=retention,
+                     tz_offset_hours=args.tz_offset_hours)
+    try:
+        app.run(port=args.port, debug=True, use_reloader=False, threaded=True)
+    finally:
+        shutdown(app)
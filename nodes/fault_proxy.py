@@ -0,0 +1,279 @@
+# nodes/fault_proxy.py
+import argparse
+import math
+import random
+import threading
+import time
+import requests
+from flask import Flask, request, jsonify, Response
+
+# Header hop-by-hop không được chuyển tiếp qua proxy
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+              'te', 'trailers', 'transfer-encoding', 'upgrade', 'content-length', 'host',
+              'content-encoding'}
+
+# Route không chịu luật '*' (chỉ chịu luật gọi đúng tên): nếu /health bị làm chậm/lỗi,
+# Leader (timeout 0.5s) đánh dấu Follower Offline và ngừng gọi tới nó, làm mất
+# chính các số liệu sao chép/scatter-gather cần đo.
+WILDCARD_EXEMPT = {'/health'}
+
+# Trường của luật: xác suất trong [0, 1], số không âm, và tham số của phân phối độ trễ
+RATE_FIELDS = {'error_rate', 'loss_rate', 'stall_rate', 'reset_rate'}
+NON_NEGATIVE_FIELDS = {'loss_penalty_ms', 'stall_seconds', 'bandwidth_kbps'}
+LATENCY_PARAMS = {'ms', 'min_ms', 'max_ms', 'mean_ms', 'stddev_ms', 'scale_ms', 'alpha'}
+
+# Kịch bản lỗi có sẵn (có thể gộp thêm luật riêng qua API điều khiển)
+SCENARIOS = {
+    # Follower chậm: mọi route trễ ~300ms, đuôi dài
+    'slow_follower': {'*': {'latency': {'dist': 'pareto', 'scale_ms': 150, 'alpha': 1.5}}},
+    # Mất gói: 10% request chịu thêm một lần timeout truyền lại TCP (~1s)
+    'packet_loss': {'*': {'loss_rate': 0.1, 'loss_penalty_ms': 1000}},
+    # Kết nối nửa mở: 20% request treo, không bao giờ trả lời trước timeout của client
+    'half_open': {'*': {'stall_rate': 0.2, 'stall_seconds': 30}},
+    # Sát timeout: /local_search mất 2.9s so với timeout 3s của fetch_search
+    'near_timeout': {'/local_search': {'latency': {'dist': 'normal', 'mean_ms': 2900, 'stddev_ms': 100}}},
+    # Follower chập chờn: 20% lỗi 503, 5% reset kết nối
+    'flaky': {'*': {'error_rate': 0.2, 'error_status': 503, 'reset_rate': 0.05}},
+    # Băng thông thấp: 64 KB/s cho cả thân request (vd: dữ liệu sao chép) và thân phản hồi
+    'low_bandwidth': {'*': {'bandwidth_kbps': 64}},
+}
+
+# ===============================
+# HÀM PHỤ TRỢ
+# ===============================
+def sample_latency_ms(spec, rng):
+    """Lấy mẫu độ trễ (ms) theo phân phối: fixed, uniform, normal, exponential, pareto."""
+    if not spec:
+        return 0.0
+    dist = spec.get('dist', 'fixed')
+    if dist == 'fixed':
+        value = spec.get('ms', 0)
+    elif dist == 'uniform':
+        value = rng.uniform(spec.get('min_ms', 0), spec.get('max_ms', 0))
+    elif dist == 'normal':
+        value = rng.gauss(spec.get('mean_ms', 0), spec.get('stddev_ms', 0))
+    elif dist == 'exponential':
+        mean = spec.get('mean_ms', 0)
+        value = rng.expovariate(1.0 / mean) if mean > 0 else 0
+    elif dist == 'pareto':
+        value = spec.get('scale_ms', 0) * rng.paretovariate(spec.get('alpha', 1.5))
+    else:
+        raise ValueError(f"Phân phối không hỗ trợ: {dist}")
+    return max(0.0, value)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def validate_rule(rule):
+    """
+    Kiểm tra kiểu và khoảng giá trị của một luật trước khi lưu (báo ValueError),
+    để luật sai không làm mọi request chuyển tiếp lỗi 500.
+    """
+    for field, value in rule.items():
+        if field in RATE_FIELDS:
+            if not is_number(value) or not 0 <= value <= 1:
+                raise ValueError(f"{field} phải là số trong [0, 1]")
+        elif field in NON_NEGATIVE_FIELDS:
+            if not is_number(value) or value < 0:
+                raise ValueError(f"{field} phải là số không âm")
+        elif field == 'upstream_timeout':
+            if not is_number(value) or value <= 0:
+                raise ValueError("upstream_timeout phải là số dương")
+        elif field == 'error_status':
+            if not isinstance(value, int) or isinstance(value, bool) or not 100 <= value <= 599:
+                raise ValueError("error_status phải là mã HTTP (100-599)")
+        elif field == 'latency':
+            if not isinstance(value, dict):
+                raise ValueError("latency phải là object, vd: {\"dist\": \"fixed\", \"ms\": 200}")
+            for param, param_value in value.items():
+                if param == 'dist':
+                    continue
+                if param not in LATENCY_PARAMS:
+                    raise ValueError(f"Tham số latency không hỗ trợ: {param}")
+                if not is_number(param_value) or param_value < 0:
+                    raise ValueError(f"latency.{param} phải là số không âm")
+            if value.get('dist') == 'pareto' and value.get('alpha', 1.5) <= 0:
+                raise ValueError("latency.alpha phải lớn hơn 0")
+            sample_latency_ms(value, random.Random())   # Báo lỗi nếu phân phối không hỗ trợ
+        else:
+            raise ValueError(f"Trường không hỗ trợ: {field}")
+
+
+def throttled(body, bandwidth_kbps, chunk_size=4096):
+    """Trả thân phản hồi theo từng khúc, ngủ giữa các khúc để giới hạn băng thông."""
+    bytes_per_second = bandwidth_kbps * 1024
+    for i in range(0, len(body), chunk_size):
+        chunk = body[i:i + chunk_size]
+        time.sleep(len(chunk) / bytes_per_second)
+        yield chunk
+
+
+def reset_midway(body):
+    """Gửi một nửa thân phản hồi rồi ngắt kết nối (client nhận phản hồi cụt)."""
+    yield body[:len(body) // 2]
+    raise ConnectionResetError("Fault proxy: injected connection reset")
+
+# ===============================
+# KHỞI TẠO FAULT PROXY
+# ===============================
+def create_app(target_url, seed=None):
+    app = Flask(__name__)
+    app.config['TARGET_URL'] = target_url.rstrip('/')
+
+    rules = {}          # route ('/local_search', ... hoặc '*') -> luật
+    stats = {}          # route -> bộ đếm
+    lock = threading.Lock()
+    rng = random.Random(seed)
+    session = requests.Session()
+
+    def rule_for(path):
+        with lock:
+            merged = {} if path in WILDCARD_EXEMPT else dict(rules.get('*', {}))
+            merged.update(rules.get(path, {}))
+        return merged
+
+    def count(path, key, amount=1):
+        with lock:
+            route_stats = stats.setdefault(path, {'requests': 0, 'delayed_ms': 0, 'errors': 0,
+                                                  'losses': 0, 'stalls': 0, 'resets': 0})
+            route_stats[key] += amount
+
+    def roll(probability):
+        with lock:
+            return probability > 0 and rng.random() < probability
+
+    # ------------------------------------
+    # 1️⃣ API ĐIỀU KHIỂN
+    # ------------------------------------
+    @app.route('/_fault/rules', methods=['GET'])
+    def get_rules():
+        with lock:
+            return jsonify({"target": app.config['TARGET_URL'], "rules": rules,
+                            "scenarios": sorted(SCENARIOS)}), 200
+
+    @app.route('/_fault/rules', methods=['POST'])
+    def set_rules():
+        """
+        Đặt luật theo route, ví dụ:
+        {"/local_search": {"latency": {"dist": "normal", "mean_ms": 2900, "stddev_ms": 100}},
+         "*": {"error_rate": 0.1}}
+        Trường hỗ trợ: latency, error_rate, error_status, loss_rate, loss_penalty_ms,
+        stall_rate, stall_seconds, reset_rate, bandwidth_kbps, upstream_timeout
+        (kiểm tra kiểu và khoảng giá trị trước khi lưu, sai thì trả về 400).
+        Luật '*' không áp dụng cho /health; muốn tiêm lỗi vào /health phải đặt luật riêng.
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or any(not isinstance(r, dict) for r in data.values()):
+            return jsonify({"ok": False, "error": "Cần object {route: luật}"}), 400
+        try:
+            for route, rule in data.items():
+                if route != '*' and not route.startswith('/'):
+                    raise ValueError(f"Route phải là '*' hoặc bắt đầu bằng '/': {route}")
+                validate_rule(rule)
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        with lock:
+            rules.update(data)
+        print(f"[FaultProxy] Luật mới cho {app.config['TARGET_URL']}: {data}")
+        return jsonify({"ok": True, "rules": rules}), 200
+
+    @app.route('/_fault/scenario/<name>', methods=['POST'])
+    def set_scenario(name):
+        """Thay toàn bộ luật bằng một kịch bản có sẵn."""
+        if name not in SCENARIOS:
+            return jsonify({"ok": False, "error": f"Kịch bản phải là một trong {sorted(SCENARIOS)}"}), 404
+        with lock:
+            rules.clear()
+            rules.update({route: dict(rule) for route, rule in SCENARIOS[name].items()})
+        print(f"[FaultProxy] Kịch bản '{name}' cho {app.config['TARGET_URL']}")
+        return jsonify({"ok": True, "rules": rules}), 200
+
+    @app.route('/_fault/reset', methods=['POST'])
+    def reset():
+        """Xóa mọi luật và bộ đếm (proxy trở lại trong suốt)."""
+        with lock:
+            rules.clear()
+            stats.clear()
+        return jsonify({"ok": True}), 200
+
+    @app.route('/_fault/stats', methods=['GET'])
+    def get_stats():
+        with lock:
+            return jsonify(stats), 200
+
+    # ------------------------------------
+    # 2️⃣ CHUYỂN TIẾP (CÓ TIÊM LỖI)
+    # ------------------------------------
+    @app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+    @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+    def forward(path):
+        route = '/' + path
+        rule = rule_for(route)
+        count(route, 'requests')
+
+        # Kết nối nửa mở: nhận request nhưng không trả lời
+        if roll(rule.get('stall_rate', 0)):
+            count(route, 'stalls')
+            time.sleep(rule.get('stall_seconds', 30))
+            return Response(status=504)
+
+        delay_ms = sample_latency_ms(rule.get('latency'), rng)
+        if roll(rule.get('loss_rate', 0)):
+            count(route, 'losses')
+            delay_ms += rule.get('loss_penalty_ms', 1000)
+        if delay_ms:
+            count(route, 'delayed_ms', int(delay_ms))
+            time.sleep(delay_ms / 1000.0)
+
+        if roll(rule.get('error_rate', 0)):
+            count(route, 'errors')
+            return jsonify({"status": "error", "message": "Fault proxy: injected error"}), \
+                rule.get('error_status', 503)
+
+        request_body = request.get_data()
+        if rule.get('bandwidth_kbps') and request_body:
+            # Thân request (payload sao chép từ Leader) cũng đi qua đường truyền chậm
+            upload_ms = len(request_body) / (rule['bandwidth_kbps'] * 1024) * 1000
+            count(route, 'delayed_ms', int(upload_ms))
+            time.sleep(upload_ms / 1000.0)
+
+        try:
+            upstream = session.request(
+                request.method, f"{app.config['TARGET_URL']}{route}",
+                params=request.args, data=request_body,
+                headers={k: v for k, v in request.headers if k.lower() not in HOP_BY_HOP},
+                timeout=rule.get('upstream_timeout', 60))
+        except requests.RequestException as e:
+            return jsonify({"status": "error", "message": f"Fault proxy: upstream lỗi: {e}"}), 502
+
+        headers = [(k, v) for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP]
+        body = upstream.content
+
+        if roll(rule.get('reset_rate', 0)):
+            count(route, 'resets')
+            headers.append(('Content-Length', str(len(body))))
+            return Response(reset_midway(body), status=upstream.status_code, headers=headers)
+        if rule.get('bandwidth_kbps'):
+            headers.append(('Content-Length', str(len(body))))
+            return Response(throttled(body, rule['bandwidth_kbps']), status=upstream.status_code, headers=headers)
+        return Response(body, status=upstream.status_code, headers=headers)
+
+    return app
+
+# ===============================
+# CHẠY FAULT PROXY
+# ===============================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a fault-injection proxy in front of a node.')
+    parser.add_argument('--port', type=int, required=True, help='Cổng của proxy.')
+    parser.add_argument('--target', type=str, required=True, help='URL của nút phía sau (vd: http://127.0.0.1:5001).')
+    parser.add_argument('--scenario', type=str, default=None, choices=sorted(SCENARIOS), help='Kịch bản lỗi khởi đầu.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed ngẫu nhiên để tái lập kết quả.')
+    args = parser.parse_args()
+
+    app = create_app(args.target, seed=args.seed)
+    if args.scenario:
+        app.test_client().post(f'/_fault/scenario/{args.scenario}')
+    app.run(port=args.port, debug=True, use_reloader=False, threaded=True)
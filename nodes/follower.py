@@ -1,11 +1,18 @@
 # nodes/follower.py
 import argparse
+import threading
 from flask import Flask, request, jsonify
 from tinydb import TinyDB, Query, where
 import os
 
+from merkle import MerkleIndex, record_hash
+
 # Biến toàn cục lưu cơ sở dữ liệu
 db = None  
+merkle_index = None
+# Khóa truy cập DB: TinyDB dùng chung một file handle, không an toàn khi đọc/ghi đồng thời;
+# /repair cũng cần kiểm tra hash bản ghi rồi mới ghi mà không để replicate_* xen vào giữa
+db_lock = threading.Lock()
 
 # ===============================
 # HÀM TÌM KIẾM (dùng chung với Leader)
@@ -53,11 +60,12 @@ def perform_search(db_instance, data):
 # ===============================
 def create_app(db_path):
     app = Flask(__name__)
-    global db
+    global db, merkle_index
 
     # Đảm bảo thư mục chứa file DB tồn tại
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
     db = TinyDB(db_path)
+    merkle_index = MerkleIndex(db)
     app.config['DB_PATH'] = db_path
 
     # ------------------------------------
@@ -72,7 +80,10 @@ def create_app(db_path):
         try:
             doc = data.get('document')
             if doc and '_id' in doc:
-                db.insert(doc)
+                # upsert: bản sao đến muộn (sau khi anti-entropy đã chèn) không tạo bản ghi trùng _id
+                with db_lock:
+                    db.upsert(doc, where('_id') == doc['_id'])
+                    merkle_index.invalidate()
                 print(f"[Follower] Đã sao chép (INSERT): {doc.get('name')} vào {app.config['DB_PATH']}")
                 return jsonify({"status": "success"}), 200
             return jsonify({"status": "error", "message": "Thiếu document hoặc _id"}), 400
@@ -95,9 +106,11 @@ def create_app(db_path):
                 return jsonify({"status": "error", "message": "Thiếu _id hoặc data"}), 400
 
             User = Query()
-            updated_count = db.update(update_data, User._id == doc_id)
+            with db_lock:
+                updated_count = db.update(update_data, User._id == doc_id)
+                merkle_index.invalidate()
 
-            if updated_count > 0:
+            if updated_count: # db.update trả về list các ID đã cập nhật
                 print(f"[Follower] Đã sao chép (UPDATE): {doc_id[:8]}...")
                 return jsonify({"status": "success"}), 200
             else:
@@ -121,9 +134,11 @@ def create_app(db_path):
                 return jsonify({"status": "error", "message": "Thiếu _id"}), 400
 
             User = Query()
-            removed_count = db.remove(User._id == doc_id)
+            with db_lock:
+                removed_count = db.remove(User._id == doc_id)
+                merkle_index.invalidate()
 
-            if removed_count > 0:
+            if removed_count: # db.remove trả về list các ID đã xóa
                 print(f"[Follower] Đã sao chép (DELETE): {doc_id[:8]}...")
                 return jsonify({"status": "success"}), 200
             else:
@@ -142,7 +157,8 @@ def create_app(db_path):
         """
         data = request.get_json()
         try:
-            results = perform_search(db, data)
+            with db_lock:
+                results = perform_search(db, data)
             print(f"[Follower] Tìm thấy {len(results)} kết quả trong {app.config['DB_PATH']}")
             return jsonify(results), 200
         except Exception as e:
@@ -150,7 +166,70 @@ def create_app(db_path):
             return jsonify({"status": "error", "message": str(e)}), 500
 
     # ------------------------------------
-    # 5️⃣ API: HEALTH CHECK
+    # 5️⃣ API: ANTI-ENTROPY (CÂY HASH)
+    # ------------------------------------
+    @app.route('/merkle_nodes', methods=['POST'])
+    def merkle_nodes():
+        """
+        Trả về hash của các nút được hỏi (theo tiền tố _id) cùng hash các nút con,
+        để Leader chỉ đi xuống những nhánh khác nhau.
+        """
+        data = request.get_json() or {}
+        with db_lock:
+            tree = merkle_index.tree()
+        return jsonify({p: tree.node(p) for p in data.get('prefixes', [])}), 200
+
+    @app.route('/merkle_records', methods=['POST'])
+    def merkle_records():
+        """Trả về bản ghi của các lá khác nhau (chỉ những lá Leader yêu cầu)."""
+        data = request.get_json() or {}
+        with db_lock:
+            tree = merkle_index.tree()
+        return jsonify({p: tree.records(p) for p in data.get('prefixes', [])}), 200
+
+    @app.route('/repair', methods=['POST'])
+    def repair():
+        """
+        Nhận bản sửa từ Leader: ghi đè các bản ghi trong 'upsert', xóa các _id trong 'delete'.
+        'expected' ({_id: hash hoặc null}) là hash bản ghi lúc Leader đọc; bản ghi đã đổi
+        kể từ đó (vd: một replicate_* vừa tới) được bỏ qua thay vì bị ghi đè.
+        """
+        data = request.get_json() or {}
+        try:
+            upserts = data.get('upsert', [])
+            deletes = data.get('delete', [])
+            expected = data.get('expected')
+            if any('_id' not in doc for doc in upserts):
+                return jsonify({"status": "error", "message": "Thiếu _id"}), 400
+
+            with db_lock:
+                skipped = 0
+                if expected is not None:
+                    current = {doc['_id']: record_hash(doc)
+                               for doc in db.search(where('_id').one_of(list(expected)))}
+
+                    def unchanged(doc_id):
+                        return doc_id not in expected or expected[doc_id] == current.get(doc_id)
+
+                    kept_upserts = [doc for doc in upserts if unchanged(doc['_id'])]
+                    kept_deletes = [doc_id for doc_id in deletes if unchanged(doc_id)]
+                    skipped = len(upserts) + len(deletes) - len(kept_upserts) - len(kept_deletes)
+                    upserts, deletes = kept_upserts, kept_deletes
+
+                stale_ids = deletes + [doc['_id'] for doc in upserts]
+                if stale_ids:
+                    db.remove(where('_id').one_of(stale_ids))
+                if upserts:
+                    db.insert_multiple(upserts)
+                merkle_index.invalidate()
+            print(f"[Follower] Anti-entropy: ghi đè {len(upserts)}, xóa {len(deletes)}, bỏ qua {skipped} bản ghi.")
+            return jsonify({"status": "success", "upserted": len(upserts), "deleted": len(deletes),
+                            "skipped": skipped}), 200
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    # ------------------------------------
+    # 6️⃣ API: HEALTH CHECK
     # ------------------------------------
     @app.route('/health', methods=['GET'])
     def health_check():
@@ -1,17 +1,48 @@
 # nodes/leader.py
 import argparse
+import json
+import queue
+import threading
+import time
 import requests
 import uuid
-from flask import Flask, request, jsonify, render_template
+from collections import deque
+from flask import Flask, request, jsonify, render_template, Response
 from tinydb import TinyDB, Query, where
 from concurrent.futures import ThreadPoolExecutor
 import os
 
+from merkle import MerkleIndex, TREE_DEPTH, diff_records, record_hash
+
 # Biến toàn cục
 db = None
 FOLLOWER_URLS = []
 executor = ThreadPoolExecutor(max_workers=10)
 
+# Trạng thái cụm được kiểm tra định kỳ ở nền (không probe lại mỗi lần click)
+HEALTH_CHECK_INTERVAL = 2
+node_status = []
+status_lock = threading.Lock()
+
+# Độ trễ gần đây của các lời gọi tới Follower: (đường đi, url) -> deque[(ms, lỗi?)]
+LATENCY_WINDOW = 1000
+latency_samples = {}
+latency_lock = threading.Lock()
+
+# Cây hash của dữ liệu Leader, dùng cho anti-entropy với các Follower
+merkle_index = None
+anti_entropy_lock = threading.Lock()
+# Khóa ghi: chỉ giữ khi ghi vào DB của Leader và khi chụp cây hash (không giữ khi gọi mạng).
+# Bản sửa anti-entropy không ghi đè thay đổi đang được sao chép dở nhờ /repair có điều kiện
+# và kiểm tra lại version của cây trước khi gửi (xem sync_follower).
+write_lock = threading.Lock()
+# Số lần chụp lại cây khi Leader có ghi mới trong lúc so sánh với một Follower
+ANTI_ENTROPY_ATTEMPTS = 3
+
+# Các client đang nghe luồng server-sent events (/events)
+subscribers = []
+subscribers_lock = threading.Lock()
+
 # ---------------------------
 # HÀM PHỤ TRỢ
 # ---------------------------
@@ -50,15 +81,53 @@ def perform_search(db_instance, data):
         print(f"Lỗi khi tìm kiếm: {e}")
         return []
 
+# ---------------------------
+# SERVER-SENT EVENTS
+# ---------------------------
+def publish_event(event, data):
+    """Gửi một sự kiện tới mọi client đang nghe /events (bỏ qua client quá chậm)."""
+    with subscribers_lock:
+        targets = list(subscribers)
+    for q in targets:
+        try:
+            q.put_nowait((event, data))
+        except queue.Full:
+            pass
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def record_latency(path, url, elapsed_ms, failed):
+    with latency_lock:
+        latency_samples.setdefault((path, url), deque(maxlen=LATENCY_WINDOW)).append((elapsed_ms, failed))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 1)
+
+
+class ActivityLog(list):
+    """Danh sách log của một thao tác; mỗi dòng được phát ngay qua SSE khi được thêm."""
+
+    def append(self, message):
+        super().append(message)
+        publish_event('log', {"time": time.strftime('%H:%M:%S'), "message": message})
+
 # ---------------------------
 # KHỞI TẠO ỨNG DỤNG LEADER
 # ---------------------------
-def create_app(db_path, followers_list, leader_port):
+def create_app(db_path, followers_list, leader_port, anti_entropy_interval=30):
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
     
-    global db, FOLLOWER_URLS
+    global db, FOLLOWER_URLS, node_status, merkle_index
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
     db = TinyDB(db_path)
+    merkle_index = MerkleIndex(db)
     FOLLOWER_URLS = followers_list
     
     app.config['LEADER_PORT'] = leader_port
@@ -74,35 +143,53 @@ def create_app(db_path, followers_list, leader_port):
     # ---------------------------
     # 1️.HÀM KIỂM TRA SỨC KHỎE CÁC NÚT
     # ---------------------------
-    def get_system_status():
+    def probe_system_status():
         """
-        Trả về danh sách trạng thái (Online/Offline) của Leader và Followers.
+        Gọi /health song song tới các Follower, trả về danh sách trạng thái
+        (Online/Offline) của Leader và Followers.
         """
-        nodes_list = []
-        health_status = {}
-
-        # Leader luôn online
         leader_url = f"http://127.0.0.1:{app.config['LEADER_PORT']}"
-        nodes_list.append({"url": leader_url, "role": app.config['LEADER_NAME'], "status": "Online"})
-        health_status[app.config['LEADER_NAME']] = "Online" # Sử dụng tên làm key
+        nodes_list = [{"url": leader_url, "role": app.config['LEADER_NAME'], "status": "Online"}]
 
-        # Kiểm tra Followers
-        for url in FOLLOWER_URLS:
-            node_name = app.config['NODE_MAP'][url]
+        def probe(url):
             try:
                 response = requests.get(f"{url}/health", timeout=0.5)
-                if response.status_code == 200:
-                    nodes_list.append({"url": url, "role": node_name, "status": "Online"})
-                    health_status[url] = "Online" # Sử dụng URL làm key cho follower
-                else:
-                    nodes_list.append({"url": url, "role": node_name, "status": "Offline"})
-                    health_status[url] = "Offline"
-            except requests.ConnectionError:
-                nodes_list.append({"url": url, "role": node_name, "status": "Offline"})
-                health_status[url] = "Offline"
-        
+                return "Online" if response.status_code == 200 else "Offline"
+            except requests.RequestException:
+                return "Offline"
+
+        futures = [(url, executor.submit(probe, url)) for url in FOLLOWER_URLS]
+        for url, future in futures:
+            nodes_list.append({"url": url, "role": app.config['NODE_MAP'][url], "status": future.result()})
+        return nodes_list
+
+    def get_system_status():
+        """
+        Trả về trạng thái đã được kiểm tra gần nhất (không gọi mạng).
+        health_status dùng tên làm key cho Leader và URL làm key cho Follower.
+        """
+        with status_lock:
+            nodes_list = [dict(n) for n in node_status]
+        health_status = {app.config['LEADER_NAME']: "Online"}
+        for node in nodes_list[1:]:
+            health_status[node['url']] = node['status']
         return nodes_list, health_status
 
+    def health_monitor():
+        """Luồng nền: kiểm tra sức khỏe định kỳ, phát sự kiện 'status' khi có thay đổi."""
+        global node_status
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            latest = probe_system_status()
+            with status_lock:
+                changed = latest != node_status
+                node_status = latest
+            if changed:
+                publish_event('status', latest)
+
+    node_status = probe_system_status()
+    threading.Thread(target=health_monitor, daemon=True).start()
+
     # ---------------------------
     # 2️.HÀM SAO CHÉP DỮ LIỆU (Broadcast)
     # ---------------------------
@@ -113,17 +200,127 @@ def create_app(db_path, followers_list, leader_port):
         online_followers = [url for url in FOLLOWER_URLS if health_status.get(url) == "Online"]
         
         def post_request(url):
+            started = time.monotonic()
             try:
-                requests.post(f"{url}/{endpoint}", json=payload, timeout=2)
-                return f"Gửi {endpoint} tới {app.config['NODE_MAP'][url]} thành công."
+                res = requests.post(f"{url}/{endpoint}", json=payload, timeout=2)
+                elapsed_ms = (time.monotonic() - started) * 1000
+                failed = res.status_code >= 400
+                record_latency('replicate', url, elapsed_ms, failed)
+                if failed:
+                    return f"Lỗi gửi {endpoint} tới {app.config['NODE_MAP'][url]}: HTTP {res.status_code} ({elapsed_ms:.0f} ms)."
+                return f"Gửi {endpoint} tới {app.config['NODE_MAP'][url]} thành công ({elapsed_ms:.0f} ms)."
             except Exception as e:
-                return f"Lỗi gửi {endpoint} tới {app.config['NODE_MAP'][url]}: {e}"
+                elapsed_ms = (time.monotonic() - started) * 1000
+                record_latency('replicate', url, elapsed_ms, True)
+                return f"Lỗi gửi {endpoint} tới {app.config['NODE_MAP'][url]} sau {elapsed_ms:.0f} ms: {e}"
 
         log_messages.append(f"Bắt đầu sao chép tới {len(online_followers)} Follower đang Online...")
         futures = [executor.submit(post_request, url) for url in online_followers]
         for future in futures:
             log_messages.append(future.result())
 
+    # ---------------------------
+    # 2️.b ANTI-ENTROPY (CÂY HASH)
+    # ---------------------------
+    def sync_follower(url, log_messages):
+        """
+        So sánh cây hash của Leader với một Follower: so gốc trước, chỉ đi xuống
+        các nhánh có hash khác, rồi chỉ gửi lại các bản ghi khác nhau.
+        Không giữ write_lock khi gọi mạng, nên để không ghi đè một thay đổi đang sao chép:
+        - nếu Leader có ghi mới trong lúc so sánh, chụp lại cây và so sánh lại;
+        - /repair gửi kèm hash bản ghi mà Follower có lúc được đọc, Follower bỏ qua
+          bản ghi đã đổi kể từ đó (vòng anti-entropy sau sẽ xét lại).
+        Trả về báo cáo (số request, số byte nhận, số bản ghi đã sửa).
+        """
+        node_name = app.config['NODE_MAP'][url]
+        report = {"node": node_name, "requests": 0, "bytes": 0, "upserted": 0, "deleted": 0, "skipped": 0}
+
+        def call(endpoint, payload):
+            res = requests.post(f"{url}/{endpoint}", json=payload, timeout=3)
+            report["requests"] += 1
+            report["bytes"] += len(res.content)
+            res.raise_for_status()
+            return res.json()
+
+        for attempt in range(ANTI_ENTROPY_ATTEMPTS):
+            with write_lock:
+                tree, version = merkle_index.snapshot()
+            remote = call('merkle_nodes', {"prefixes": [""]})
+            if remote[""]["hash"] == tree.root():
+                report["in_sync"] = True
+                return report
+
+            # Đi xuống từng mức, mỗi mức một request cho mọi nhánh khác nhau
+            frontier, differing_leaves = [""], []
+            while frontier:
+                next_level = []
+                for prefix in frontier:
+                    local_children = tree.child_hashes(prefix)
+                    remote_children = remote.get(prefix, {}).get("children", {})
+                    for child in set(local_children) | set(remote_children):
+                        if local_children.get(child) != remote_children.get(child):
+                            (differing_leaves if len(child) >= TREE_DEPTH else next_level).append(child)
+                frontier = next_level
+                if frontier:
+                    remote = call('merkle_nodes', {"prefixes": frontier})
+
+            upserts, deletes, expected = [], [], {}
+            if differing_leaves:
+                remote_records = call('merkle_records', {"prefixes": differing_leaves})
+                for prefix in differing_leaves:
+                    leaf_remote = remote_records.get(prefix, [])
+                    leaf_upserts, leaf_deletes = diff_records(tree.records(prefix), leaf_remote)
+                    upserts.extend(leaf_upserts)
+                    deletes.extend(leaf_deletes)
+                    expected.update({doc['_id']: record_hash(doc) for doc in leaf_remote})
+
+            if merkle_index.changed_since(version):
+                # Cây đã cũ: bản sửa có thể đảo ngược một ghi mới của Leader
+                continue
+
+            result = {"skipped": 0}
+            if upserts or deletes:
+                # expected[_id] = None: Follower chưa có bản ghi đó lúc được đọc
+                result = call('repair', {"upsert": upserts, "delete": deletes,
+                                         "expected": {i: expected.get(i) for i in
+                                                      deletes + [doc['_id'] for doc in upserts]}})
+                log_messages.append(f"ANTI-ENTROPY: {node_name} lệch {len(differing_leaves)} nhánh, "
+                                    f"đã sửa {result.get('upserted', 0)} bản ghi, "
+                                    f"xóa {result.get('deleted', 0)} bản ghi, "
+                                    f"bỏ qua {result.get('skipped', 0)} bản ghi vừa đổi "
+                                    f"({report['requests']} request, {report['bytes']} byte).")
+            report.update(in_sync=False, upserted=result.get('upserted', 0),
+                          deleted=result.get('deleted', 0), skipped=result.get('skipped', 0))
+            return report
+
+        log_messages.append(f"ANTI-ENTROPY: Leader ghi liên tục trong lúc so sánh với {node_name}, "
+                            f"để lại cho vòng sau ({report['requests']} request).")
+        report.update(in_sync=False, deferred=True)
+        return report
+
+    def run_anti_entropy(log_messages):
+        """Chạy một vòng anti-entropy với mọi Follower đang Online."""
+        _, health_status = get_system_status()
+        reports = []
+        with anti_entropy_lock:
+            for url in FOLLOWER_URLS:
+                if health_status.get(url) != "Online":
+                    continue
+                try:
+                    reports.append(sync_follower(url, log_messages))
+                except Exception as e:
+                    log_messages.append(f"ANTI-ENTROPY: Lỗi với {app.config['NODE_MAP'][url]}: {e}")
+                    reports.append({"node": app.config['NODE_MAP'][url], "error": str(e)})
+        return reports
+
+    def anti_entropy_loop():
+        while True:
+            time.sleep(anti_entropy_interval)
+            run_anti_entropy(ActivityLog())
+
+    if anti_entropy_interval > 0:
+        threading.Thread(target=anti_entropy_loop, daemon=True).start()
+
     # ---------------------------
     # ⭐ HÀM HELPER MỚI: LOGIC TÌM KIẾM TÁI SỬ DỤNG
     # ---------------------------
@@ -138,16 +335,23 @@ def create_app(db_path, followers_list, leader_port):
                 raise ValueError("Nhập ít nhất một điều kiện tìm kiếm.")
             
             log_messages.append(f"SCATTER: Truy vấn song song {search_payload}")
+            scatter_started = time.monotonic()
             futures_map = {}
             online_followers = [url for url in FOLLOWER_URLS if health_status.get(url) == "Online"]
 
             # Gửi truy vấn song song đến các Follower
             def fetch_search(url):
+                """Trả về (kết quả, thời gian ms, lỗi hoặc None)."""
+                started = time.monotonic()
                 try:
                     res = requests.post(f"{url}/local_search", json=search_payload, timeout=3)
-                    return res.json() if res.status_code == 200 else []
-                except Exception:
-                    return []
+                    error = None if res.status_code == 200 else f"HTTP {res.status_code}"
+                    results = res.json() if res.status_code == 200 else []
+                except Exception as e:
+                    error, results = e.__class__.__name__, []
+                elapsed_ms = (time.monotonic() - started) * 1000
+                record_latency('search', url, elapsed_ms, error is not None)
+                return results, elapsed_ms, error
 
             for url in online_followers:
                 futures_map[executor.submit(fetch_search, url)] = url
@@ -164,13 +368,17 @@ def create_app(db_path, followers_list, leader_port):
             for future in futures_map:
                 url = futures_map[future]
                 node_name = app.config['NODE_MAP'][url]
-                results = future.result()
+                results, elapsed_ms, error = future.result()
                 for r in results:
                     r['source_node'] = node_name
                 all_results.extend(results)
-                log_messages.append(f"GATHER: {node_name} có {len(results)} kết quả.")
+                if error:
+                    log_messages.append(f"GATHER: {node_name} lỗi ({error}) sau {elapsed_ms:.0f} ms.")
+                else:
+                    log_messages.append(f"GATHER: {node_name} có {len(results)} kết quả ({elapsed_ms:.0f} ms).")
 
-            log_messages.append(f"AGGREGATE: Tổng cộng {len(all_results)} kết quả.")
+            gather_ms = (time.monotonic() - scatter_started) * 1000
+            log_messages.append(f"AGGREGATE: Tổng cộng {len(all_results)} kết quả ({gather_ms:.0f} ms).")
             message = f"Tìm thấy {len(all_results)} kết quả."
             return all_results, message, "success"
         
@@ -179,6 +387,76 @@ def create_app(db_path, followers_list, leader_port):
             log_messages.append(f"Lỗi khi tìm kiếm: {e}")
             return [], message, "error"
 
+    # ---------------------------
+    # HÀM HELPER: CÁC THAO TÁC GHI (dùng chung cho form và JSON API)
+    # ---------------------------
+    def _insert_document(name, age, city, log_messages, health_status):
+        doc = {'_id': str(uuid.uuid4()), 'name': name, 'age': age, 'city': city}
+        with write_lock:
+            db.insert(doc)
+            merkle_index.invalidate()
+        log_messages.append(f"LEADER: Đã chèn '{name}' (ID: {doc['_id'][:8]}...)")
+        broadcast_request('replicate_insert', {"document": doc}, log_messages, health_status)
+        return doc
+
+    def _update_document(doc_id, new_name, new_age, new_city, log_messages, health_status):
+        if not doc_id or not new_name or not new_city:
+            raise ValueError("Thiếu thông tin cập nhật (ID, Tên, Tuổi, Thành phố)")
+
+        User = Query()
+        update_data = {"name": new_name, "age": new_age, "city": new_city}
+        payload = {"_id": doc_id, "data": update_data}
+
+        with write_lock:
+            updated_count = db.update(update_data, User._id == doc_id)
+            merkle_index.invalidate()
+        if not updated_count: # db.update trả về list các ID đã cập nhật
+            raise ValueError(f"Không tìm thấy bản ghi có ID {doc_id} trên Leader.")
+
+        log_messages.append(f"LEADER: Đã cập nhật bản ghi {doc_id[:8]}... (Tên={new_name}, Tuổi={new_age}, TP={new_city}).")
+        broadcast_request('replicate_update', payload, log_messages, health_status)
+        return update_data
+
+    def _delete_document(doc_id, log_messages, health_status):
+        if not doc_id:
+            raise ValueError("Thiếu ID")
+
+        User = Query()
+        with write_lock:
+            removed = db.remove(User._id == doc_id)
+            merkle_index.invalidate()
+        if not removed: # db.remove trả về list các ID đã xóa
+            raise ValueError(f"Không tìm thấy bản ghi {doc_id}")
+
+        log_messages.append(f"LEADER: Đã xóa bản ghi {doc_id[:8]}...")
+        broadcast_request('replicate_delete', {"_id": doc_id}, log_messages, health_status)
+
+    def _last_search_from_form(log_messages, health_status):
+        """
+        Tìm lại theo tiêu chí cũ (do form gửi lên) sau khi Sửa/Xóa mà không có JavaScript.
+        Trả về (last_search_payload, all_results, search_msg, search_msg_type) hoặc None.
+        """
+        last_search_name = request.form.get('last_search_name')
+        last_search_age = request.form.get('last_search_age')
+        last_search_city = request.form.get('last_search_city')
+
+        if last_search_name is None or last_search_age is None or last_search_city is None:
+            return None
+        last_search_payload = {
+            "name": last_search_name,
+            "age": last_search_age,
+            "city": last_search_city
+        }
+        # Chỉ tìm lại nếu có ít nhất 1 tiêu chí
+        if not any(v for v in last_search_payload.values() if v):
+            return last_search_payload, None, "", "success"
+        log_messages.append("---")
+        log_messages.append("Tự động tải lại kết quả tìm kiếm...")
+        all_results, search_msg, search_msg_type = _perform_scatter_gather_search(
+            last_search_payload, log_messages, health_status
+        )
+        return last_search_payload, all_results, search_msg, search_msg_type
+
     # ---------------------------
     # 3️.GIAO DIỆN WEB
     # ---------------------------
@@ -192,13 +470,13 @@ def create_app(db_path, followers_list, leader_port):
                                last_search=None) # Thêm last_search=None
 
     # ---------------------------
-    # 4️.API: INSERT
+    # 4️.FORM: INSERT
     # ---------------------------
     @app.route('/insert', methods=['POST'])
     def insert():
         # (Không thay đổi, vẫn render results=None sau khi Chèn)
         nodes_list, health_status = get_system_status()
-        log_messages = []
+        log_messages = ActivityLog()
         message = ""
         message_type = "success"
         
@@ -207,11 +485,7 @@ def create_app(db_path, followers_list, leader_port):
             age = int(request.form['age'])
             city = request.form['city']
 
-            doc = {'_id': str(uuid.uuid4()), 'name': name, 'age': age, 'city': city}
-            db.insert(doc)
-            log_messages.append(f"LEADER: Đã chèn '{name}' (ID: {doc['_id'][:8]}...)")
-
-            broadcast_request('replicate_insert', {"document": doc}, log_messages, health_status)
+            _insert_document(name, age, city, log_messages, health_status)
             message = f"Thành công: Đã chèn '{name}'."
         except Exception as e:
             message = f"Lỗi: {e}"
@@ -223,15 +497,15 @@ def create_app(db_path, followers_list, leader_port):
                                log_messages=log_messages, last_search=None)
 
     # ---------------------------
-    # 5️.API: UPDATE (CẬP NHẬT)
+    # 5️.FORM: UPDATE (CẬP NHẬT)
     # ---------------------------
     @app.route('/update', methods=['POST'])
     def update():
         """ 
-        Xử lý yêu cầu UPDATE và TẢI LẠI KẾT QUẢ TÌM KIẾM.
+        Xử lý yêu cầu UPDATE và TẢI LẠI KẾT QUẢ TÌM KIẾM (khi không dùng JavaScript).
         """
         nodes_list, health_status = get_system_status()
-        log_messages = []
+        log_messages = ActivityLog()
         message = ""
         message_type = "success"
         all_results = None     # Mặc định là None
@@ -240,47 +514,18 @@ def create_app(db_path, followers_list, leader_port):
         try:
             # 1. THỰC HIỆN CẬP NHẬT
             doc_id = request.form['doc_id']
-            new_name = request.form['name']
-            new_age = int(request.form['age']) 
-            new_city = request.form['city']
-            
-            if not doc_id or not new_name or not new_city: 
-                raise ValueError("Thiếu thông tin cập nhật (ID, Tên, Tuổi, Thành phố)")
-                
-            User = Query()
-            update_data = {"name": new_name, "age": new_age, "city": new_city}
-            payload = {"_id": doc_id, "data": update_data}
-            
-            updated_count = db.update(update_data, User._id == doc_id)
-            if updated_count == 0:
-                raise ValueError(f"Không tìm thấy bản ghi có ID {doc_id} trên Leader.")
-            
-            log_messages.append(f"LEADER: Đã cập nhật bản ghi {doc_id[:8]}... (Tên={new_name}, Tuổi={new_age}, TP={new_city}).")
-            broadcast_request('replicate_update', payload, log_messages, health_status)
+            _update_document(doc_id, request.form['name'], int(request.form['age']),
+                             request.form['city'], log_messages, health_status)
             message = f"Thành công: Đã cập nhật bản ghi {doc_id[:8]}..."
             
             # 2. KIỂM TRA VÀ TÌM KIẾM LẠI
-            last_search_name = request.form.get('last_search_name')
-            last_search_age = request.form.get('last_search_age')
-            last_search_city = request.form.get('last_search_city')
-
-            # Nếu có thông tin tìm kiếm cũ (do JS gửi lên)
-            if last_search_name is not None and last_search_age is not None and last_search_city is not None:
-                last_search_payload = {
-                    "name": last_search_name,
-                    "age": last_search_age,
-                    "city": last_search_city
-                }
-                # Chỉ tìm lại nếu có ít nhất 1 tiêu chí
-                if any(v for v in last_search_payload.values() if v):
-                    log_messages.append("---")
-                    log_messages.append("Tự động tải lại kết quả tìm kiếm...")
-                    all_results, search_msg, search_msg_type = _perform_scatter_gather_search(
-                        last_search_payload, log_messages, health_status
-                    )
+            reloaded = _last_search_from_form(log_messages, health_status)
+            if reloaded:
+                last_search_payload, all_results, search_msg, search_msg_type = reloaded
+                if search_msg:
                     message += f" | {search_msg}"
-                    if search_msg_type == "error":
-                        message_type = "error"
+                if search_msg_type == "error":
+                    message_type = "error"
 
         except Exception as e:
             message = f"Lỗi: {str(e)}"
@@ -296,15 +541,15 @@ def create_app(db_path, followers_list, leader_port):
                                last_search=last_search_payload) # Trả về tiêu chí cũ
 
     # ---------------------------
-    # 6️.API: DELETE (CẬP NHẬT)
+    # 6️.FORM: DELETE (CẬP NHẬT)
     # ---------------------------
     @app.route('/delete', methods=['POST'])
     def delete():
         """ 
-        Xử lý yêu cầu DELETE và TẢI LẠI KẾT QUẢ TÌM KIẾM.
+        Xử lý yêu cầu DELETE và TẢI LẠI KẾT QUẢ TÌM KIẾM (khi không dùng JavaScript).
         """
         nodes_list, health_status = get_system_status()
-        log_messages = []
+        log_messages = ActivityLog()
         message = ""
         message_type = "success"
         all_results = None     # Mặc định là None
@@ -313,38 +558,17 @@ def create_app(db_path, followers_list, leader_port):
         try:
             # 1. THỰC HIỆN XÓA
             doc_id = request.form['doc_id']
-            if not doc_id:
-                raise ValueError("Thiếu ID")
-
-            User = Query()
-            removed = db.remove(User._id == doc_id)
-            if not removed: # db.remove trả về list các ID đã xóa
-                raise ValueError(f"Không tìm thấy bản ghi {doc_id}")
-
-            log_messages.append(f"LEADER: Đã xóa bản ghi {doc_id[:8]}...")
-            broadcast_request('replicate_delete', {"_id": doc_id}, log_messages, health_status)
+            _delete_document(doc_id, log_messages, health_status)
             message = f"Thành công: Đã xóa bản ghi {doc_id[:8]}..."
 
             # 2. KIỂM TRA VÀ TÌM KIẾM LẠI
-            last_search_name = request.form.get('last_search_name')
-            last_search_age = request.form.get('last_search_age')
-            last_search_city = request.form.get('last_search_city')
-
-            if last_search_name is not None and last_search_age is not None and last_search_city is not None:
-                last_search_payload = {
-                    "name": last_search_name,
-                    "age": last_search_age,
-                    "city": last_search_city
-                }
-                if any(v for v in last_search_payload.values() if v):
-                    log_messages.append("---")
-                    log_messages.append("Tự động tải lại kết quả tìm kiếm...")
-                    all_results, search_msg, search_msg_type = _perform_scatter_gather_search(
-                        last_search_payload, log_messages, health_status
-                    )
+            reloaded = _last_search_from_form(log_messages, health_status)
+            if reloaded:
+                last_search_payload, all_results, search_msg, search_msg_type = reloaded
+                if search_msg:
                     message += f" | {search_msg}"
-                    if search_msg_type == "error":
-                        message_type = "error"
+                if search_msg_type == "error":
+                    message_type = "error"
 
         except Exception as e:
             message = f"Lỗi: {e}"
@@ -360,7 +584,7 @@ def create_app(db_path, followers_list, leader_port):
                                last_search=last_search_payload) # Trả về tiêu chí cũ
 
     # ---------------------------
-    # 7️.API: SEARCH (CẬP NHẬT)
+    # 7️.FORM: SEARCH (CẬP NHẬT)
     # ---------------------------
     @app.route('/search', methods=['POST'])
     def search():
@@ -368,7 +592,7 @@ def create_app(db_path, followers_list, leader_port):
         Hàm SEARCH chính, giờ chỉ gọi hàm helper.
         """
         nodes_list, health_status = get_system_status()
-        log_messages = []
+        log_messages = ActivityLog()
         
         search_payload = {
             "name": request.form.get('name', ''),
@@ -390,7 +614,124 @@ def create_app(db_path, followers_list, leader_port):
                                last_search=search_payload) # Trả về tiêu chí tìm kiếm
 
     # ---------------------------
-    # 8️.API NỘI BỘ
+    # 8️.JSON API CHO DASHBOARD (AJAX)
+    # ---------------------------
+    # Log được phát qua /events ngay khi phát sinh, nên các API này chỉ trả về kết quả.
+    @app.route('/api/status', methods=['GET'])
+    def api_status():
+        nodes_list, _ = get_system_status()
+        return jsonify(nodes_list), 200
+
+    @app.route('/api/insert', methods=['POST'])
+    def api_insert():
+        data = request.get_json(silent=True) or {}
+        _, health_status = get_system_status()
+        log_messages = ActivityLog()
+        try:
+            doc = _insert_document(data['name'], int(data['age']), data['city'], log_messages, health_status)
+            return jsonify({"ok": True, "message": f"Thành công: Đã chèn '{doc['name']}'.", "document": doc}), 200
+        except Exception as e:
+            log_messages.append(f"Lỗi khi chèn: {e}")
+            return jsonify({"ok": False, "message": f"Lỗi: {e}"}), 400
+
+    @app.route('/api/update', methods=['POST'])
+    def api_update():
+        data = request.get_json(silent=True) or {}
+        _, health_status = get_system_status()
+        log_messages = ActivityLog()
+        try:
+            doc_id = data.get('_id', '')
+            update_data = _update_document(doc_id, data.get('name'), int(data.get('age')),
+                                           data.get('city'), log_messages, health_status)
+            return jsonify({"ok": True, "message": f"Thành công: Đã cập nhật bản ghi {doc_id[:8]}...",
+                            "_id": doc_id, "data": update_data}), 200
+        except Exception as e:
+            log_messages.append(f"Lỗi nghiêm trọng khi cập nhật: {e}")
+            return jsonify({"ok": False, "message": f"Lỗi: {e}"}), 400
+
+    @app.route('/api/delete', methods=['POST'])
+    def api_delete():
+        data = request.get_json(silent=True) or {}
+        _, health_status = get_system_status()
+        log_messages = ActivityLog()
+        try:
+            doc_id = data.get('_id', '')
+            _delete_document(doc_id, log_messages, health_status)
+            return jsonify({"ok": True, "message": f"Thành công: Đã xóa bản ghi {doc_id[:8]}...",
+                            "_id": doc_id}), 200
+        except Exception as e:
+            log_messages.append(f"Lỗi khi xóa: {e}")
+            return jsonify({"ok": False, "message": f"Lỗi: {e}"}), 400
+
+    @app.route('/api/search', methods=['POST'])
+    def api_search():
+        data = request.get_json(silent=True) or {}
+        _, health_status = get_system_status()
+        search_payload = {key: str(data.get(key, '')) for key in ('name', 'age', 'city')}
+        all_results, message, message_type = _perform_scatter_gather_search(
+            search_payload, ActivityLog(), health_status
+        )
+        return jsonify({"ok": message_type == "success", "message": message, "results": all_results}), 200
+
+    @app.route('/api/metrics', methods=['GET'])
+    def api_metrics():
+        """
+        Phân vị độ trễ (ms) của các lời gọi sao chép / scatter-gather tới từng Follower
+        trong LATENCY_WINDOW lần gần nhất - dùng để đo mức suy giảm khi tiêm lỗi.
+        """
+        with latency_lock:
+            snapshot = {key: list(samples) for key, samples in latency_samples.items()}
+        metrics = []
+        for (path, url), samples in sorted(snapshot.items()):
+            values = sorted(ms for ms, _ in samples)
+            metrics.append({
+                "path": path, "node": app.config['NODE_MAP'].get(url, url),
+                "count": len(samples), "errors": sum(1 for _, failed in samples if failed),
+                "p50": percentile(values, 50), "p95": percentile(values, 95),
+                "p99": percentile(values, 99), "max": percentile(values, 100),
+            })
+        return jsonify(metrics), 200
+
+    @app.route('/api/metrics/reset', methods=['POST'])
+    def api_metrics_reset():
+        with latency_lock:
+            latency_samples.clear()
+        return jsonify({"ok": True}), 200
+
+    @app.route('/api/anti_entropy', methods=['POST'])
+    def api_anti_entropy():
+        """Chạy ngay một vòng anti-entropy và trả về báo cáo từng Follower."""
+        log_messages = ActivityLog()
+        log_messages.append("ANTI-ENTROPY: Bắt đầu so sánh cây hash với các Follower...")
+        reports = run_anti_entropy(log_messages)
+        return jsonify({"ok": all('error' not in r for r in reports), "reports": reports}), 200
+
+    @app.route('/events')
+    def events():
+        """Luồng server-sent events: 'log' (nhật ký hoạt động) và 'status' (trạng thái cụm)."""
+        client_queue = queue.Queue(maxsize=500)
+        with subscribers_lock:
+            subscribers.append(client_queue)
+        nodes_list, _ = get_system_status()
+
+        def stream():
+            try:
+                yield format_sse('status', nodes_list)
+                while True:
+                    try:
+                        event, data = client_queue.get(timeout=15)
+                        yield format_sse(event, data)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+            finally:
+                with subscribers_lock:
+                    subscribers.remove(client_queue)
+
+        return Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    # ---------------------------
+    # 9️.API NỘI BỘ
     # ---------------------------
     @app.route('/local_search', methods=['POST'])
     def local_search_api():
@@ -415,6 +756,7 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, required=True, help='Port để chạy.')
     parser.add_argument('--db', type=str, required=True, help='Đường dẫn file TinyDB.')
     parser.add_argument('--followers', type=str, required=True, help='Danh sách URL của Followers (phân cách bởi dấu phẩy).')
+    parser.add_argument('--anti-entropy-interval', type=float, default=30, help='Chu kỳ anti-entropy (giây), 0 để tắt.')
     
     args = parser.parse_args()
     
@@ -425,5 +767,5 @@ if __name__ == '__main__':
     if db_dir: # Nếu có chỉ định thư mục (vd: 'data/leader_db.json')
         os.makedirs(db_dir, exist_ok=True)
 
-    app = create_app(args.db, follower_list, args.port)
+    app = create_app(args.db, follower_list, args.port, anti_entropy_interval=args.anti_entropy_interval)
     app.run(port=args.port, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,117 @@
+# nodes/merkle.py
+import hashlib
+import json
+import threading
+
+# Số ký tự đầu của _id dùng để chia cây (mỗi mức 1 ký tự hex -> 16 nhánh, 3 mức = 4096 lá)
+TREE_DEPTH = 3
+
+# ===============================
+# HÀM PHỤ TRỢ
+# ===============================
+def digest(text):
+    """Hash ngắn (16 ký tự hex) - đủ để phát hiện khác biệt, nhỏ khi gửi qua mạng."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def record_hash(doc):
+    return digest(json.dumps(doc, sort_keys=True, ensure_ascii=False))
+
+# ===============================
+# CÂY HASH THEO KHOẢNG _id
+# ===============================
+class MerkleTree:
+    """
+    Cây hash trên các bản ghi có _id (bản ghi được sao chép).
+    Nút có khóa là tiền tố của _id: "" là gốc, lá là tiền tố dài TREE_DEPTH.
+    Bản ghi không có _id (dữ liệu gốc phân mảnh) không thuộc cây.
+    """
+
+    def __init__(self, docs):
+        self.leaves = {}      # tiền tố lá -> {_id: bản ghi}
+        self.hashes = {}      # tiền tố -> hash
+        self.children = {}    # tiền tố cha -> [tiền tố con]
+
+        for doc in docs:
+            doc_id = doc.get('_id')
+            if doc_id:
+                self.leaves.setdefault(doc_id[:TREE_DEPTH], {})[doc_id] = dict(doc)
+
+        for prefix, records in self.leaves.items():
+            self.hashes[prefix] = digest(''.join(f"{i}:{record_hash(records[i])}" for i in sorted(records)))
+
+        level = list(self.leaves)
+        for _ in range(TREE_DEPTH):
+            parents = {}
+            for prefix in level:
+                parents.setdefault(prefix[:-1], []).append(prefix)
+            for parent, kids in parents.items():
+                kids.sort()
+                self.children[parent] = kids
+                self.hashes[parent] = digest(''.join(f"{k}:{self.hashes[k]}" for k in kids))
+            level = list(parents)
+
+        self.hashes.setdefault('', digest(''))
+
+    def root(self):
+        return self.hashes['']
+
+    def node(self, prefix):
+        """Hash của một nút và các nút con (để bên kia so sánh và đi xuống)."""
+        return {
+            "hash": self.hashes.get(prefix),
+            "children": {k: self.hashes[k] for k in self.children.get(prefix, [])},
+        }
+
+    def child_hashes(self, prefix):
+        return self.node(prefix)["children"]
+
+    def records(self, prefix):
+        return list(self.leaves.get(prefix, {}).values())
+
+
+class MerkleIndex:
+    """
+    Giữ cây hash của một TinyDB, chỉ dựng lại sau khi có thao tác ghi.
+    Mọi đường ghi vào DB phải gọi invalidate() SAU khi ghi xong.
+    """
+
+    def __init__(self, db_instance):
+        self.db = db_instance
+        self.lock = threading.Lock()
+        self._version = 0          # Tăng mỗi lần invalidate()
+        self._built_version = None
+        self._tree = None
+
+    def invalidate(self):
+        with self.lock:
+            self._version += 1
+
+    def tree(self):
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """Trả về (cây, version mà cây phản ánh) để kiểm tra sau đó có ghi xen vào không."""
+        with self.lock:
+            if self._tree is None or self._built_version != self._version:
+                # Ghi nhận version TRƯỚC khi đọc: ghi xen giữa sẽ làm cây bị dựng lại lần sau
+                self._built_version = self._version
+                self._tree = MerkleTree(self.db.all())
+            return self._tree, self._built_version
+
+    def changed_since(self, version):
+        with self.lock:
+            return self._version != version
+
+
+def diff_records(local_records, remote_records):
+    """
+    So sánh bản ghi của các lá khác nhau.
+    Trả về (bản ghi cần ghi đè/chèn lên bên kia, _id cần xóa ở bên kia).
+    """
+    remote_by_id = {doc['_id']: doc for doc in remote_records}
+    local_by_id = {doc['_id']: doc for doc in local_records}
+    upserts = [doc for doc_id, doc in local_by_id.items()
+               if doc_id not in remote_by_id or record_hash(doc) != record_hash(remote_by_id[doc_id])]
+    deletes = [doc_id for doc_id in remote_by_id if doc_id not in local_by_id]
+    return upserts, deletes
@@ -0,0 +1,229 @@
+# nodes/rollup.py
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+# Độ phân giải bucket hỗ trợ (tên -> số giây)
+RESOLUTIONS = {'1m': 60, '1h': 3600, '1d': 86400}
+BUCKET_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Khoảng thời gian (giây) của mỗi file rollup theo độ phân giải: mỗi lần ghi chỉ ghi lại
+# các file có bucket thay đổi, nên file phải nhỏ (1000 thùng ~ 10.000 bucket 1 phút / file)
+WINDOW_SECONDS = {'1m': 600, '1h': 6 * 3600, '1d': 7 * 86400}
+WINDOW_NAME_FORMAT = '%Y%m%dT%H%M'
+
+# ===============================
+# HÀM PHỤ TRỢ
+# ===============================
+def parse_timestamp(ts):
+    """Đọc timestamp ISO 8601 và chuyển về UTC (timestamp không có múi giờ được coi là UTC)."""
+    dt = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def bucket_start(dt, seconds, offset_seconds=0):
+    """
+    Làm tròn xuống đầu bucket theo múi giờ offset_seconds (vd: +7h thì bucket 1 ngày
+    bắt đầu lúc 00:00 giờ địa phương), trả về chuỗi UTC (so sánh chuỗi = so sánh thời gian).
+    """
+    epoch = int(dt.timestamp()) + offset_seconds
+    start = datetime.fromtimestamp(epoch - epoch % seconds - offset_seconds, tz=timezone.utc)
+    return start.strftime(BUCKET_FORMAT)
+
+
+def format_bound(value, seconds=None, offset_seconds=0):
+    """
+    Chuẩn hóa tham số start/end của API về cùng định dạng với khóa bucket.
+    Với start, truyền seconds để làm tròn xuống đầu bucket chứa nó.
+    """
+    if not value:
+        return None
+    dt = parse_timestamp(value)
+    if seconds:
+        return bucket_start(dt, seconds, offset_seconds)
+    return dt.strftime(BUCKET_FORMAT)
+
+
+def key_epoch(key):
+    return int(datetime.strptime(key, BUCKET_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+
+
+def empty_bucket():
+    return {'count': 0, 'total_weight_kg': 0.0, 'max_fill_level': None, 'by_type': {}}
+
+
+def reading_bucket(doc):
+    """Bucket chỉ chứa một bản đọc; báo lỗi (TypeError/ValueError) nếu giá trị không hợp lệ."""
+    fill = doc.get('fill_level')
+    if fill is not None and (isinstance(fill, bool) or not isinstance(fill, (int, float))):
+        raise TypeError(f"fill_level không hợp lệ: {fill!r}")
+    waste_type = doc.get('type') or 'unknown'
+    if not isinstance(waste_type, str):
+        raise TypeError(f"type không hợp lệ: {waste_type!r}")
+    return {'count': 1, 'total_weight_kg': round(float(doc.get('weight_kg') or 0), 6),
+            'max_fill_level': fill, 'by_type': {waste_type: 1}}
+
+
+def merge_bucket(target, source):
+    """Cộng dồn source vào target (cả hai đã hợp lệ, không thể lỗi)."""
+    target['count'] += source['count']
+    target['total_weight_kg'] = round(target['total_weight_kg'] + source['total_weight_kg'], 6)
+    fill = source['max_fill_level']
+    if fill is not None and (target['max_fill_level'] is None or fill > target['max_fill_level']):
+        target['max_fill_level'] = fill
+    for waste_type, n in source['by_type'].items():
+        target['by_type'][waste_type] = target['by_type'].get(waste_type, 0) + n
+    return target
+
+
+def copy_bucket(bucket):
+    return dict(bucket, by_type=dict(bucket['by_type']))
+
+# ===============================
+# KHO ROLLUP TĂNG DẦN
+# ===============================
+class RollupStore:
+    """
+    Rollup theo thùng rác ở các bucket 1 phút / 1 giờ / 1 ngày.
+    Cập nhật tăng dần lúc ingest để dashboard đọc bucket đã tính sẵn thay vì quét
+    lại toàn bộ bản đọc thô. Bucket được giữ trong bộ nhớ và lưu theo cửa sổ thời gian:
+    mỗi (độ phân giải, cửa sổ WINDOW_SECONDS) một file JSON trong thư mục directory,
+    nên mỗi lần ghi chỉ ghi lại các cửa sổ vừa thay đổi (thường là cửa sổ hiện tại),
+    và chính sách lưu giữ xóa nguyên file của cửa sổ đã quá hạn.
+    """
+
+    def __init__(self, directory, retention=None, tz_offset_hours=0):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # retention: {'raw': timedelta, '1m': timedelta, ...}; thiếu khóa = giữ mãi
+        self.retention = retention or {}
+        # Múi giờ căn bucket (chủ yếu cho bucket 1 ngày); phải giữ nguyên giữa các lần chạy
+        self.offset_seconds = int(tz_offset_hours * 3600)
+        self.lock = threading.Lock()
+        # windows[(resolution, đầu cửa sổ epoch giây)][(bin_id, bucket_key)] = {...}
+        self.windows = {}
+        self.load()
+
+    def window_for(self, resolution, key):
+        epoch = key_epoch(key)
+        return resolution, epoch - epoch % WINDOW_SECONDS[resolution]
+
+    def path_for(self, window):
+        resolution, start = window
+        name = datetime.fromtimestamp(start, tz=timezone.utc).strftime(WINDOW_NAME_FORMAT)
+        return os.path.join(self.directory, f"{resolution}-{name}.json")
+
+    def load(self):
+        for name in os.listdir(self.directory):
+            resolution, _, stamp = name.partition('-')
+            if resolution not in RESOLUTIONS or not stamp.endswith('.json'):
+                continue
+            try:
+                start = datetime.strptime(stamp[:-len('.json')], WINDOW_NAME_FORMAT)
+            except ValueError:
+                continue
+            window = (resolution, int(start.replace(tzinfo=timezone.utc).timestamp()))
+            with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                docs = json.load(f)
+            self.windows[window] = {
+                (doc['bin_id'], doc['bucket']): {
+                    'count': doc['count'], 'total_weight_kg': doc['total_weight_kg'],
+                    'max_fill_level': doc['max_fill_level'], 'by_type': dict(doc['by_type']),
+                } for doc in docs
+            }
+
+    def is_empty(self):
+        return not self.windows
+
+    def add_readings(self, readings):
+        """
+        Cộng dồn một lô bản đọc vào các bucket rồi lưu các cửa sổ bị thay đổi.
+        Phần thay đổi của cả lô được tính xong trước (bản đọc không hợp lệ bị bỏ qua),
+        và mỗi cửa sổ chỉ được đưa vào bộ nhớ sau khi đã lưu, nên lỗi giữa chừng không
+        làm bộ nhớ lệch với file.
+        """
+        batch = {}      # (resolution, bin_id, bucket) -> bucket của riêng lô này
+        for doc in readings:
+            try:
+                dt = parse_timestamp(doc['timestamp'])
+                reading = reading_bucket(doc)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                print(f"[Rollup] Bỏ qua bản đọc không hợp lệ {doc.get('id')}: {e}")
+                continue
+            bin_id = doc.get('bin_id', 'unknown')
+            for resolution, seconds in RESOLUTIONS.items():
+                key = (resolution, bin_id, bucket_start(dt, seconds, self.offset_seconds))
+                merge_bucket(batch.setdefault(key, empty_bucket()), reading)
+
+        with self.lock:
+            changed = {}    # cửa sổ -> bản sao đã cộng dồn lô này
+            for (resolution, bin_id, key), delta in batch.items():
+                window = self.window_for(resolution, key)
+                if window not in changed:
+                    changed[window] = dict(self.windows.get(window, {}))
+                buckets = changed[window]
+                current = buckets.get((bin_id, key))
+                buckets[(bin_id, key)] = merge_bucket(copy_bucket(current) if current else empty_bucket(), delta)
+            for window, buckets in changed.items():
+                self._write_window(window, buckets)
+                self.windows[window] = buckets
+        return len(batch)
+
+    def _write_window(self, window, buckets):
+        """Ghi lại một cửa sổ: ghi ra file tạm rồi đổi tên (không để lại file ghi dở)."""
+        path = self.path_for(window)
+        docs = [dict(bucket, bin_id=b, bucket=key) for (b, key), bucket in buckets.items()]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(docs, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def query(self, resolution, bin_id=None, start=None, end=None):
+        """
+        Trả về các bucket giao với khoảng [start, end), sắp xếp theo thời gian
+        (start được làm tròn xuống đầu bucket chứa nó).
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution phải là một trong {list(RESOLUTIONS)}")
+        start = format_bound(start, RESOLUTIONS[resolution], self.offset_seconds)
+        end = format_bound(end)
+        rows = []
+        with self.lock:
+            for (res, window_start), buckets in self.windows.items():
+                if res != resolution:
+                    continue
+                # Bỏ qua cả cửa sổ nằm ngoài khoảng cần đọc
+                first = datetime.fromtimestamp(window_start, tz=timezone.utc).strftime(BUCKET_FORMAT)
+                last = datetime.fromtimestamp(window_start + WINDOW_SECONDS[res], tz=timezone.utc).strftime(BUCKET_FORMAT)
+                if (end and first >= end) or (start and last <= start):
+                    continue
+                for (b, key), bucket in buckets.items():
+                    if (bin_id and b != bin_id) or (start and key < start) or (end and key >= end):
+                        continue
+                    rows.append(dict(copy_bucket(bucket), bin_id=b, bucket=key))
+        rows.sort(key=lambda r: (r['bucket'], r['bin_id']))
+        return rows
+
+    def expire(self, now=None):
+        """
+        Áp dụng chính sách lưu giữ: xóa các cửa sổ đã kết thúc trước hạn lưu giữ
+        (bucket được giữ thêm tối đa một cửa sổ). Trả về số bucket đã xóa.
+        """
+        now = now or datetime.now(timezone.utc)
+        removed = 0
+        with self.lock:
+            for window in list(self.windows):
+                resolution, window_start = window
+                if resolution not in self.retention:
+                    continue
+                cutoff = (now - self.retention[resolution]).timestamp()
+                if window_start + WINDOW_SECONDS[resolution] > cutoff:
+                    continue
+                if os.path.exists(self.path_for(window)):
+                    os.remove(self.path_for(window))
+                removed += len(self.windows.pop(window))
+        return removed
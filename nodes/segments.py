@@ -0,0 +1,108 @@
+# nodes/segments.py
+import json
+import os
+from datetime import datetime, timezone
+
+from rollup import parse_timestamp
+
+SEGMENT_PREFIX = 'raw-'
+SEGMENT_SUFFIX = '.jsonl'
+SEGMENT_NAME_FORMAT = '%Y%m%dT%H%M'
+
+# ===============================
+# KHO BẢN ĐỌC THÔ CHIA ĐOẠN THEO THỜI GIAN
+# ===============================
+class SegmentedLog:
+    """
+    Lưu bản đọc thô thành các file JSON Lines chỉ ghi nối, mỗi file một khoảng thời gian
+    (mặc định 1 giờ, theo timestamp của bản đọc, giờ UTC).
+    - Mỗi lô chỉ nối thêm dòng vào file của đoạn chứa nó, không đọc/ghi lại lịch sử
+      (khác với insert_multiple của TinyDB, vốn ghi lại toàn bộ file mỗi lần).
+    - Chính sách lưu giữ xóa nguyên file của các đoạn đã quá hạn.
+    """
+
+    def __init__(self, directory, segment_seconds=3600):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        # Đoạn đã được kiểm tra kết thúc bằng '\n' (dòng ghi dở khi bị tắt đột ngột)
+        self.checked = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def segment_start(self, doc):
+        """Đầu đoạn (epoch giây) chứa bản đọc; timestamp hỏng thì xếp theo lúc nhận."""
+        try:
+            epoch = int(parse_timestamp(doc['timestamp']).timestamp())
+        except (KeyError, TypeError, ValueError, AttributeError):
+            epoch = int(datetime.now(timezone.utc).timestamp())
+        return epoch - epoch % self.segment_seconds
+
+    def path_for(self, start):
+        name = datetime.fromtimestamp(start, tz=timezone.utc).strftime(SEGMENT_NAME_FORMAT)
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{name}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """Danh sách (đầu đoạn epoch giây, đường dẫn) theo thứ tự thời gian."""
+        found = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+                continue
+            stamp = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+            try:
+                start = datetime.strptime(stamp, SEGMENT_NAME_FORMAT).replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue
+            found.append((int(start.timestamp()), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def append(self, docs):
+        """Nối một lô bản đọc vào các đoạn tương ứng; trả về sau khi đã fsync."""
+        by_segment = {}
+        for doc in docs:
+            by_segment.setdefault(self.segment_start(doc), []).append(doc)
+
+        for start, segment_docs in by_segment.items():
+            path = self.path_for(start)
+            lines = ''.join(json.dumps(doc, ensure_ascii=False) + '\n' for doc in segment_docs)
+            with open(path, 'a+b') as f:
+                if path not in self.checked:
+                    # Dòng cuối ghi dở (tắt đột ngột) không được dính vào dòng mới
+                    if f.tell() > 0:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            f.write(b'\n')
+                    self.checked.add(path)
+                f.write(lines.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_segment(self, path):
+        docs = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    docs.append(json.loads(line))
+                except ValueError:
+                    continue   # Dòng ghi dở: chưa từng được xác nhận với thùng rác
+        return docs
+
+    def all(self):
+        for _, path in self.segments():
+            yield from self.read_segment(path)
+
+    def is_empty(self):
+        return not self.segments()
+
+    def expire(self, cutoff):
+        """
+        Xóa các đoạn kết thúc trước cutoff (datetime UTC).
+        Trả về danh sách 'id' của các bản đọc đã bị xóa.
+        """
+        cutoff_epoch = cutoff.timestamp()
+        removed_ids = []
+        for start, path in self.segments():
+            if start + self.segment_seconds > cutoff_epoch:
+                break
+            removed_ids.extend(doc['id'] for doc in self.read_segment(path) if 'id' in doc)
+            os.remove(path)
+            self.checked.discard(path)
+        return removed_ids
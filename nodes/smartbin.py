@@ -0,0 +1,136 @@
+# nodes/smartbin.py
+import argparse
+import random
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from uuid import uuid4
+from tinydb import TinyDB, where
+import os
+
+# Số bản đọc tối đa gửi trong một request /ingest
+PUSH_BATCH_SIZE = 500
+
+# ===============================
+# NÚT THÙNG RÁC (SMART BIN)
+# ===============================
+class SmartBin:
+    """Một thùng rác thông minh với bộ nhớ TinyDB cục bộ (từ prototype Node trong notebook)."""
+
+    def __init__(self, bin_id, db_path=None):
+        self.bin_id = bin_id
+        self.db_path = db_path or f'{bin_id}_local.json'
+        self.db = TinyDB(self.db_path)
+        # Thời điểm sớm nhất được phép gửi lại (theo Retry-After của Aggregator)
+        self.retry_at = 0.0
+
+    def sense(self, weight_kg=None, fill_level=None, waste_type=None, timestamp=None):
+        rec = {
+            'id': str(uuid4()),
+            'bin_id': self.bin_id,
+            'timestamp': (timestamp or datetime.now(timezone(timedelta(hours=7))).isoformat()),
+            'weight_kg': weight_kg if weight_kg is not None else round(random.uniform(0.1, 5.0), 3),
+            'fill_level': fill_level if fill_level is not None else random.randint(5, 100),
+            'type': waste_type or random.choice(['general', 'recyclable', 'organic']),
+            'synced': False
+        }
+        self.db.insert(rec)
+        return rec
+
+    def get_unsynced(self, limit=None):
+        unsynced = self.db.search(where('synced') == False)
+        return unsynced[:limit] if limit else unsynced
+
+    def mark_synced(self, ids):
+        """Đánh dấu đã đồng bộ bằng MỘT lệnh update (một lần ghi file) cho cả lô."""
+        if not ids:
+            return []
+        return self.db.update({'synced': True}, where('id').one_of(list(ids)))
+
+    def purge_synced(self):
+        """Xóa các bản đọc đã đồng bộ để file cục bộ không phình to mãi."""
+        return self.db.remove(where('synced') == True)
+
+    def push(self, aggregator_url, batch_size=PUSH_BATCH_SIZE, timeout=5):
+        """
+        Gửi các bản đọc chưa đồng bộ theo lô tới Aggregator.
+        Trả về (số bản đọc được xác nhận, phản hồi cuối cùng).
+        Chỉ các bản đọc trong acked_ids (đã được Aggregator ghi xuống đĩa) mới được
+        đánh dấu synced; khi Aggregator báo quá tải (503/429), tạm dừng theo Retry-After.
+        """
+        if time.monotonic() < self.retry_at:
+            return 0, {'ok': False, 'error': 'backoff'}
+
+        pushed = 0
+        resp = {'ok': True, 'received': 0}
+        while True:
+            unsynced = self.get_unsynced(limit=batch_size)
+            if not unsynced:
+                return pushed, resp
+            try:
+                res = requests.post(f"{aggregator_url}/ingest", json={'readings': unsynced}, timeout=timeout)
+            except Exception as e:
+                return pushed, {'ok': False, 'error': str(e)}
+
+            if res.status_code in (429, 503):
+                try:
+                    delay = float(res.headers.get('Retry-After', 1))
+                except ValueError:
+                    delay = 1.0
+                # Thêm jitter để hàng nghìn thùng không gửi lại cùng lúc
+                self.retry_at = time.monotonic() + delay * random.uniform(1.0, 1.5)
+                return pushed, {'ok': False, 'error': 'backpressure', 'retry_after': delay}
+
+            resp = res.json() if res.status_code == 200 else {'ok': False, 'error': res.text}
+            if not resp.get('ok'):
+                return pushed, resp
+
+            acked = resp.get('acked_ids', [])
+            self.mark_synced(acked)
+            pushed += len(acked)
+            if len(acked) < batch_size:
+                return pushed, resp
+
+# ===============================
+# MÔ PHỎNG NHIỀU THÙNG RÁC
+# ===============================
+def run_simulation(aggregator_url, num_bins, interval, data_dir, rounds=None, workers=50):
+    """Mỗi chu kỳ: mọi thùng đo một bản đọc, rồi gửi song song tới Aggregator."""
+    os.makedirs(data_dir, exist_ok=True)
+    bins = [SmartBin(f'bin-{i+1}', db_path=os.path.join(data_dir, f'bin-{i+1}_local.json'))
+            for i in range(num_bins)]
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def cycle(node):
+        node.sense()
+        pushed, resp = node.push(aggregator_url)
+        if resp.get('ok'):
+            node.purge_synced()
+        return pushed, resp
+
+    r = 0
+    while rounds is None or r < rounds:
+        started = time.monotonic()
+        results = list(executor.map(cycle, bins))
+        pushed = sum(p for p, _ in results)
+        throttled = sum(1 for _, resp in results if resp.get('error') in ('backpressure', 'backoff'))
+        print(f"[SmartBin] Chu kỳ {r+1}: đã gửi {pushed} bản đọc, {throttled} thùng đang bị giới hạn "
+              f"({time.monotonic() - started:.2f}s)")
+        r += 1
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    executor.shutdown()
+    return bins
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate Smart Bin nodes pushing readings.')
+    parser.add_argument('--aggregator', type=str, required=True, help='URL của Aggregator.')
+    parser.add_argument('--bins', type=int, default=100, help='Số thùng rác mô phỏng.')
+    parser.add_argument('--interval', type=float, default=3.0, help='Chu kỳ đo/gửi (giây).')
+    parser.add_argument('--rounds', type=int, default=None, help='Số chu kỳ (mặc định: chạy mãi).')
+    parser.add_argument('--data-dir', type=str, default='data/bins', help='Thư mục chứa DB cục bộ của các thùng.')
+    args = parser.parse_args()
+
+    run_simulation(args.aggregator, args.bins, args.interval, args.data_dir, rounds=args.rounds)
@@ -16,6 +16,15 @@ DB_PATH_F2 = 'data/follower2_db.json'
 URL_LEADER = f"http://127.0.0.1:{PORT_LEADER}"
 URL_F1 = f"http://127.0.0.1:{PORT_F1}"
 URL_F2 = f"http://127.0.0.1:{PORT_F2}"
+
+# Fault proxy (tùy chọn): `python run.py --fault-proxy` đặt một proxy tiêm lỗi
+# trước mỗi Follower, Leader sẽ gọi Follower thông qua proxy.
+USE_FAULT_PROXY = '--fault-proxy' in sys.argv
+PORT_P1 = 5101
+PORT_P2 = 5102
+URL_P1 = f"http://127.0.0.1:{PORT_P1}"
+URL_P2 = f"http://127.0.0.1:{PORT_P2}"
+FOLLOWER_URLS = f'{URL_P1},{URL_P2}' if USE_FAULT_PROXY else f'{URL_F1},{URL_F2}'
 # -------------------------
 
 # Kiểm tra xem có đang chạy trong virtual environment không
@@ -46,7 +55,7 @@ try:
         sys.executable, 'nodes/leader.py',
         '--port', str(PORT_LEADER),
         '--db', DB_PATH_LEADER,
-        '--followers', f'{URL_F1},{URL_F2}'
+        '--followers', FOLLOWER_URLS
     ]
     # Popen không block, và chúng ta chuyển hướng output vào DEVNULL để terminal chính gọn gàng
     # Bạn có thể bỏ stdout và stderr để xem log của từng tiến trình ngay tại đây
@@ -73,10 +82,24 @@ try:
     print(f"Đang khởi chạy Follower 2 trên cổng {PORT_F2}...")
     f2_process = subprocess.Popen(f2_cmd, stdout=sys.stdout, stderr=sys.stderr)
     processes.append(f2_process)
+
+    # 2.4. Khởi chạy Fault Proxy trước mỗi Follower (nếu bật)
+    if USE_FAULT_PROXY:
+        for proxy_port, target_url in [(PORT_P1, URL_F1), (PORT_P2, URL_F2)]:
+            proxy_cmd = [
+                sys.executable, 'nodes/fault_proxy.py',
+                '--port', str(proxy_port),
+                '--target', target_url
+            ]
+            print(f"Đang khởi chạy Fault Proxy trên cổng {proxy_port} -> {target_url}...")
+            processes.append(subprocess.Popen(proxy_cmd, stdout=sys.stdout, stderr=sys.stderr))
     
     print("\n" + "="*50)
     print("TẤT CẢ CÁC NÚT ĐÃ SẴN SÀNG!")
     print(f"==> Mở trình duyệt và truy cập: {URL_LEADER}")
+    if USE_FAULT_PROXY:
+        print(f"==> API điều khiển lỗi: {URL_P1}/_fault/rules, {URL_P2}/_fault/rules")
+        print(f"==> Độ trễ đo tại Leader: {URL_LEADER}/api/metrics")
     print("="*50)
     print("\nNhấn (Ctrl+C) trong terminal này để tắt tất cả các nút.")
     